@@ -1,4 +1,4 @@
-from core.dblite import DBlite, gW
+from core.dblite import DBlite
 from core.filemanager import FM
 from core.wiki import WIKI
 from core.config_log import config_log
@@ -12,11 +12,17 @@ from core.country import CF
 from core.filmaffinity import FilmAffinityApi
 import re
 from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from core.util import get_env, iter_parallel
 
 config_log("log/complete_db.log")
 
 logger = logging.getLogger(__name__)
-DB = DBlite("imdb.sqlite", reload=False, quick_release=True)
+DB = DBlite("imdb.sqlite", reload=False, quick_release=True, wal=True)
+# FilmAffinity limita las peticiones: por defecto de una en una
+FM_WORKERS = int(get_env('FILMAFFINITY_WORKERS', default='1'))
+re_min = re.compile(r"^\d+ min$")
 
 
 def load_url(url: str):
@@ -62,17 +68,36 @@ def load_files(*paths: str):
     return obj
 
 
-def load_dict(name: str):
-    obj = load_files(
-        f"{G.page}/{name}.json",
-        f"out/{name}.json",
-        f"rec/{name}.json",
-        f"rec/{name}.dct.txt",
-        f"select movie, {name} from EXTRA where {name} is not null"
-    )
+def load_extra(*names: str) -> dict[str, dict]:
+    obj: dict[str, dict] = {n: {} for n in names}
+    sql = f"select movie, {', '.join(names)} from EXTRA where " + " or ".join(f"{n} is not null" for n in names)
+    try:
+        for movie, *values in DB.select(sql):
+            for n, v in zip(names, values):
+                if v is not None:
+                    obj[n][movie] = v
+    except OperationalError:
+        pass
+    for n, r in obj.items():
+        if r:
+            logger.info(f"EXTRA.{n} = {len(r)}")
     return obj
 
 
+def load_dicts(*names: str) -> tuple[dict, ...]:
+    with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+        remote = tuple(executor.map(load_url, (f"{G.page}/{n}.json" for n in names)))
+    extra = load_extra(*names)
+    return tuple(
+        {
+            **rmt,
+            **load_files(f"out/{n}.json", f"rec/{n}.json", f"rec/{n}.dct.txt"),
+            **extra[n]
+        }
+        for n, rmt in zip(names, remote)
+    )
+
+
 def dump_dict(name: str):
     obj = DB.get_dict(f"select movie, {name} from EXTRA where {name} is not null order by movie, {name}")
     FM.dump(f"out/{name}.json", obj)
@@ -84,14 +109,9 @@ def dump_dict(name: str):
 
 
 def union(*args):
-    s = set()
-    for a in args:
-        if a is None:
-            continue
-        if isinstance(a, dict):
-            a = a.keys()
-        s = s.union(a)
-    return sorted(s)
+    return sorted(set().union(*(
+        a.keys() if isinstance(a, dict) else a for a in args if a is not None
+    )))
 
 
 DB.executescript(FM.load("sql/extra.sql"))
@@ -100,34 +120,45 @@ DB.executescript(FM.load("sql/extra.sql"))
 def complete(ids: Union[set[int], list[int], tuple[int, ...]]):
     logger.info(f"{len(ids)} IDS principales")
 
-    wiki = load_dict("wikipedia")
-    film = load_dict("filmaffinity")
-    cntr = load_dict("countries")
+    wiki, film, cntr = load_dicts("wikipedia", "filmaffinity", "countries")
 
     ids = set(ids).union(union(wiki, film, cntr))
-    if len(ids):
-        ids = DB.to_tuple(f"select id from movie where id {gW(ids)}", *ids)
-    ids = set(ids)
-
-    film = {
-        **film,
-        **WIKI.get_filmaffinity(*ids.difference(film.keys()))
-    }
-    wiki = {
-        **wiki,
-        **WIKI.get_wiki_url(*ids.difference(wiki.keys()))
-    }
-    cntr = {
-        **cntr,
-        **IMDB.get_countries(*ids.difference(cntr.keys()))
-    }
-
-    for i in ids.difference(film.keys()):
-        year = DB.one("select year from MOVIE where id = ?", i)
-        if year is None:
-            continue
-        titles = DB.to_tuple("select title from title where movie = ?", i)
-        ff = FilmAffinityApi.search(year, *titles)
+    tmp_ids = DB.tmp_table("tmp_ids", *ids)
+    ids = set(DB.to_tuple(f"select m.id from movie m join {tmp_ids} t on t.id = m.id"))
+
+    miss_film: list[str] = []
+    miss_wiki: list[str] = []
+    miss_cntr: list[str] = []
+    for i in ids:
+        if i not in film:
+            miss_film.append(i)
+        if i not in wiki:
+            miss_wiki.append(i)
+        if i not in cntr:
+            miss_cntr.append(i)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        new_film = executor.submit(WIKI.get_filmaffinity, *miss_film)
+        new_wiki = executor.submit(WIKI.get_wiki_url, *miss_wiki)
+        new_cntr = executor.submit(IMDB.get_countries, *miss_cntr)
+    film = {**film, **new_film.result()}
+    wiki = {**wiki, **new_wiki.result()}
+    cntr = {**cntr, **new_cntr.result()}
+
+    tmp_search = DB.tmp_table("tmp_search", *(i for i in miss_film if i not in film))
+    years: dict[str, int] = DB.get_dict(
+        f"select m.id, m.year from movie m join {tmp_search} t on t.id = m.id where m.year is not null"
+    )
+    titles: dict[str, list[str]] = defaultdict(list)
+    for i, title in DB.select(f"select t.movie, t.title from title t join {tmp_search} s on s.id = t.movie"):
+        titles[i].append(title)
+    to_search = [(i, year, tuple(titles[i])) for i, year in years.items()]
+
+    for (i, _year, _titles), ff in iter_parallel(
+        FM_WORKERS,
+        lambda x: FilmAffinityApi.search(x[1], *x[2]),
+        to_search
+    ):
         if ff:
             film[i] = ff.id
 
@@ -139,47 +170,47 @@ def complete(ids: Union[set[int], list[int], tuple[int, ...]]):
             continue
         film_prioridad.insert(0, (k, f))
 
-    for k, f in film_prioridad:
-        fm = FilmAffinityApi.get(f)
+    telefilm: list[tuple[str]] = []
+    for (k, f), fm in iter_parallel(FM_WORKERS, lambda kf: FilmAffinityApi.get(kf[1]), film_prioridad):
         if fm is None:
             continue
         if fm.country is not None:
             cntr[k] = fm.country
         if fm.genres and 'Telefilm' in fm.genres:
-            DB.executemany("UPDATE MOVIE SET type='tvMovie' where id = ?", (k,))
-    DB.flush()
+            telefilm.append((k, ))
 
-    for i in union(film, wiki, cntr):
-        DB.executemany(
-            "INSERT INTO EXTRA (movie, filmaffinity, wikipedia, countries) values (?, ?, ?, ?)",
-            (i, film.get(i), wiki.get(i), cntr.get(i))
-        )
-    DB.flush()
+    fields: dict[str, list[tuple[int, str]]] = {}
     for field, (om_field, fm_field) in {
         'year': ('Year', 'year'),
         'duration': ('Runtime', 'duration')
     }.items():
         if len(ids) == 0:
             continue
-        for i in DB.to_tuple(f"select id from movie where {field} is null and id {gW(ids)}", *ids):
+        values: list[tuple[int, str]] = []
+        for i in DB.to_tuple(f"select m.id from movie m join {tmp_ids} t on t.id = m.id where m.{field} is null"):
             om = IMDB.get_from_omdbapi(i)
             value = om.get(om_field) if om else None
             if isinstance(value, str):
                 value = value.strip()
                 if value.isdecimal():
                     value = int(value)
-                elif re.match(r"^\d+ min$", value):
+                elif re_min.match(value):
                     value = int(value.split()[0])
             if not isinstance(value, int):
                 fm = FilmAffinityApi.get(film.get(i))
                 value = fm._asdict().get(fm_field) if fm else None
             if isinstance(value, int):
-                DB.executemany(
-                    f"UPDATE MOVIE SET {field}=? where id=?",
-                    (value, i)
-                )
-        DB.flush()
-    DB.commit()
+                values.append((value, i))
+        fields[field] = values
+
+    with DB.atomic():
+        DB.executemany("UPDATE MOVIE SET type='tvMovie' where id = ?", *telefilm)
+        DB.execute_batch(
+            "INSERT INTO EXTRA (movie, filmaffinity, wikipedia, countries) values",
+            *((i, film.get(i), wiki.get(i), cntr.get(i)) for i in union(film, wiki, cntr))
+        )
+        for field, values in fields.items():
+            DB.executemany(f"UPDATE MOVIE SET {field}=? where id=?", *values)
 
     dump_dict('wikipedia')
     dump_dict('filmaffinity')
@@ -18,6 +18,15 @@ def sha256_hash(*args, **kwargs) -> str:
     return hashlib.sha256(data.encode('utf-8')).hexdigest()
 
 
+def _to_tuple(v):
+    # json devuelve listas donde se guardaron tuplas
+    if isinstance(v, list):
+        return tuple(_to_tuple(i) for i in v)
+    if isinstance(v, dict):
+        return {k: _to_tuple(i) for k, i in v.items()}
+    return v
+
+
 def to_timestamp(s):
     if not isinstance(s, str):
         return None
@@ -126,3 +135,67 @@ class HashCache(Cache):
     def parse_file_name(self, *args, slf=None, **kwargs):
         hash = sha256_hash(*args, **kwargs)
         return self.file.format(hash)
+
+
+class DictCache:
+    """
+    Diccionario persistido en un fichero json donde cada valor caduca
+    a los maxOld días de haberse guardado
+    """
+
+    def __init__(self, file: str, maxOld: float = 30):
+        self.file = file
+        self.maxOld = None if maxOld is None else maxOld * 86400
+        self.__data: dict[str, list] | None = None
+        self.__changed = False
+
+    @property
+    def data(self) -> dict[str, list]:
+        if self.__data is None:
+            self.__data = self.__load()
+        return self.__data
+
+    def __load(self) -> dict[str, list]:
+        if not FM.resolve_path(self.file).is_file():
+            return {}
+        try:
+            js = FM.load(self.file)
+        except ValueError as e:
+            logger.warning(f"DictCache.load({self.file}) {e}")
+            return {}
+        if not isinstance(js, dict):
+            return {}
+        limit = None if self.maxOld is None else time.time() - self.maxOld
+        data: dict[str, list] = {}
+        for k, tv in js.items():
+            if not isinstance(tv, list) or len(tv) != 2:
+                continue
+            t, v = tv
+            if isinstance(t, bool) or not isinstance(t, (int, float)):
+                continue
+            if limit is not None and t < limit:
+                continue
+            data[k] = [t, _to_tuple(v)]
+        return data
+
+    def get(self, key: str, default=None):
+        tv = self.data.get(key)
+        if tv is None:
+            return default
+        return tv[1]
+
+    def set(self, key: str, value):
+        self.data[key] = [int(time.time()), value]
+        self.__changed = True
+
+    def clear(self):
+        self.__data = {}
+        self.__changed = True
+
+    def save(self):
+        if not self.__changed:
+            return
+        logger.debug(f"DictCache.save({self.file})")
+        FM.dump(self.file, self.data, indent=None)
+        self.__changed = False
+
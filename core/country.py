@@ -1,5 +1,5 @@
-from pycountry.db import Country as DBCountry
 from pycountry import countries as DBCountries, historic_countries
+from functools import cache, cached_property
 import logging
 import re
 
@@ -23,6 +23,12 @@ CUSTOM_ALIASES = {
     "VDR": ("North Vietnam", "Vietnam del norte", "Viet Nam, República Democrática de"),
     "XKS": ("XKX", "UNK", "KOS", "YUG-KO", "Kosovo"),
 }
+# recorrido al revés para que, si un alias se repite, gane el primer código
+ALIAS_TO_CODE: dict[str, str] = {
+    alias: code
+    for code, aliases in reversed(CUSTOM_ALIASES.items())
+    for alias in aliases
+}
 
 
 class CountryFinder:
@@ -56,55 +62,48 @@ class CountryFinder:
         if crt and crt.alpha_3:
             return crt.alpha_3.upper()
 
+    @cache
     def parse_alpha3(self, cod: str, silent: bool = False) -> str | None:
         if cod in (None, '', 'N/A'):
             return None
-        if cod in CUSTOM_ALIASES.keys():
+        if cod in CUSTOM_ALIASES:
             return cod
-        for k, v in CUSTOM_ALIASES.items():
-            if cod in v:
-                return k
+        if cod in ALIAS_TO_CODE:
+            return ALIAS_TO_CODE[cod]
         c = self.__parse_alpha3(cod)
         if c is not None:
             return c
         if not silent:
             self.__log_error(f"Código alpha3 de país no encontrado: {cod}")
 
-    def __search_country_by_name(self, name: str):
-        c: DBCountry = DBCountries.get(name=name)
-        if c is not None:
-            return c
-        lw_name = name.lower()
+    @cached_property
+    def __name_index(self) -> dict[str, str]:
+        index: dict[str, str] = {}
         for c in DBCountries:
-            for f in ("name", "official_name", "common_name"):
-                if hasattr(c, f):
-                    value = getattr(c, f)
-                    if not isinstance(value, str):
-                        continue
-                    if lw_name == value.lower():
-                        return c
-        for c in historic_countries:
-            for f in ("name", "official_name", "common_name"):
-                if hasattr(c, f):
-                    value = getattr(c, f)
-                    if not isinstance(value, str):
-                        continue
-                    if lw_name == value.lower():
-                        return c
-        return None
+            index.setdefault(c.name.lower(), c.alpha_3.upper())
+        for db in (DBCountries, historic_countries):
+            for c in db:
+                for f in ("name", "official_name", "common_name"):
+                    value = getattr(c, f, None)
+                    if isinstance(value, str):
+                        index.setdefault(value.lower(), c.alpha_3.upper())
+        return index
+
+    def __search_country_by_name(self, name: str) -> str | None:
+        return self.__name_index.get(name.lower())
 
+    @cache
     def to_alpha_3(self, s: str, silent: bool = False):
         if s is None:
             return None
         s = re_sp.sub(" ", s).strip()
         if s in ('', 'N/A'):
             return None
-        for k, v in CUSTOM_ALIASES.items():
-            if s in v:
-                return k
+        if s in ALIAS_TO_CODE:
+            return ALIAS_TO_CODE[s]
         c = self.__search_country_by_name(name=s)
         if c is not None:
-            return c.alpha_3.upper()
+            return c
         if s == s.upper() and len(s) == 3:
             cod = self.__parse_alpha3(s)
             if cod is not None:
@@ -5,6 +5,8 @@ from os.path import isfile
 from os import remove
 from atexit import register
 from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,8 +22,9 @@ def gW(tp: tuple):
 
 
 class DBlite:
-    def __init__(self, file: str, reload: bool = False, quick_release: bool = False):
+    def __init__(self, file: str, reload: bool = False, quick_release: bool = False, wal: bool = False):
         self.__file = file
+        self.__wal = wal
         if reload and isfile(self.__file):
             remove(self.__file)
         self.__con = None
@@ -38,6 +41,11 @@ class DBlite:
         if self.__con is None:
             logger.info(f"Connecting to {self.__file}")
             self.__con = sqlite3.connect(self.__file)
+            if self.__wal:
+                self.__con.execute("PRAGMA journal_mode=WAL")
+                self.__con.execute("PRAGMA synchronous=NORMAL")
+            self.__con.execute("PRAGMA temp_store=MEMORY")
+            self.__con.execute("PRAGMA cache_size=-65536")
         return self.__con
 
     def execute(self, sql: str, *args, log_level: int = None):
@@ -51,14 +59,45 @@ class DBlite:
     def executescript(self, sql: str):
         return self.con.executescript(sql)
 
-    def executemany(self, sql: str, vals: tuple):
-        self.__many[sql].append(vals)
+    def executemany(self, sql: str, *vals: tuple):
+        if len(vals) == 0:
+            return None
+        self.__many[sql].extend(vals)
         if len(self.__many[sql]) < 1000:
             return None
         r = self.con.executemany(sql, self.__many[sql])
         del self.__many[sql]
         return r
 
+    @property
+    def max_variables(self) -> int:
+        getlimit = getattr(self.con, "getlimit", None)
+        if getlimit is None:
+            return 999
+        return getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+
+    def execute_batch(self, sql: str, *vals: tuple, chunk: int = 500):
+        if len(vals) == 0:
+            return
+        width = len(vals[0])
+        size = max(1, min(chunk, self.max_variables // width))
+        row = "(" + ", ".join(["?"] * width) + ")"
+        for i in range(0, len(vals), size):
+            rows = vals[i:i + size]
+            self.con.execute(
+                f"{sql} " + ", ".join([row] * len(rows)),
+                tuple(chain.from_iterable(rows))
+            )
+
+    def tmp_table(self, name: str, *vals):
+        self.execute(f"DROP TABLE IF EXISTS temp.{name}")
+        self.execute(f"CREATE TEMP TABLE {name} (id PRIMARY KEY)")
+        self.con.executemany(
+            f"INSERT OR IGNORE INTO temp.{name} (id) VALUES (?)",
+            ((v, ) for v in vals)
+        )
+        return f"temp.{name}"
+
     def select(self, sql: str, *args, **kwargs):
         cursor = self.con.cursor()
         try:
@@ -113,6 +152,23 @@ class DBlite:
     def commit(self):
         self.con.commit()
 
+    @contextmanager
+    def atomic(self):
+        # sqlite3 abre transacciones implícitas (ej: tmp_table), se cierran
+        # antes para que BEGIN IMMEDIATE tome el bloqueo de escritura
+        self.flush()
+        if self.con.in_transaction:
+            self.con.commit()
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+            self.flush()
+        except BaseException:
+            self.__many.clear()
+            self.con.rollback()
+            raise
+        self.commit()
+
     def close(self):
         if self.__con is None:
             return
@@ -135,5 +191,7 @@ class DBlite:
             logger.info(f"Vacuum {self.__file}")
             self.execute("VACUUM")
             self.commit()
+        if self.__wal:
+            self.execute("PRAGMA journal_mode=DELETE")
         self.__con.close()
         self.__con = None
@@ -1,4 +1,5 @@
 import json
+import orjson
 import logging
 from os import makedirs
 from os.path import dirname, realpath
@@ -130,15 +131,32 @@ class FileManager:
         for k in ('separators', 'indent'):
             if k in kwargs:
                 del kwargs[k]
-        with open(file, "r") as f:
+        if args or kwargs:
+            with open(file, "r") as f:
+                try:
+                    return json.load(f, *args, **kwargs)
+                except JSONDecodeError as e:
+                    raise myex(e, str(file))
+        with open(file, "rb") as f:
             try:
-                return json.load(f, *args, **kwargs)
-            except JSONDecodeError as e:
+                return orjson.loads(f.read())
+            except orjson.JSONDecodeError as e:
                 raise myex(e, str(file))
 
     def dump_json(self, file, obj, *args, indent=2, **kwargs):
-        with open(file, "w") as f:
-            json.dump(self.__parse(obj), f, *args, indent=indent, **kwargs)
+        """
+        Con indent=2 y sin más argumentos escribe con orjson, que no es
+        byte a byte igual que json.dump: los caracteres no ASCII van en
+        UTF-8 en vez de como \\uXXXX y algunos float cambian de forma
+        (1e16 en vez de 1e+16). El resto de casos sigue usando json.dump
+        """
+        if args or kwargs or indent != 2:
+            with open(file, "w") as f:
+                json.dump(self.__parse(obj), f, *args, indent=indent, **kwargs)
+            return
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2
+        with open(file, "wb") as f:
+            f.write(orjson.dumps(self.__parse(obj), option=option))
 
     def load_txt(self, file, *args, **kwargs):
         with open(file, "r") as f:
@@ -1,41 +1,91 @@
 from core.util import buildSoup
-from core.cache import StaticCache
-from bs4 import BeautifulSoup, Tag
+from core.cache import StaticCache, StaticHashCache
+from bs4 import Tag
 from core.country import CF
 import re
 from typing import NamedTuple, Optional
 import cloudscraper
+from urllib3.util.retry import Retry
 import logging
 from datetime import datetime
 from urllib.parse import quote
-from functools import cache
+from functools import cache, cached_property
+import soupsieve as sv
 
 
 logger = logging.getLogger(__name__)
 
 re_sp = re.compile(r"\s+")
+re_title = re.compile(r"<title[^>]*>([^<]*)</title>", re.IGNORECASE)
+re_min = re.compile(r"^\d+ min\.?$")
+re_reviews = re.compile(r"^\d+\s+.*$")
+re_scrape = (
+    re.compile(r"filmaffinity\.com/[a-z]+/film(\d+).html"),
+    re.compile(r'"filmaffinity"\s*:\s*(\d+)')
+)
 
 FM_SCRAPER = cloudscraper.create_scraper()
+for _adapter in FM_SCRAPER.adapters.values():
+    # sin Retry-After: una cabecera muy grande podría bloquear el hilo sin límite
+    _adapter.max_retries = Retry(
+        total=5,
+        backoff_factor=1.5,
+        status_forcelist=(429, 502, 503, 504),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+FM_PARSER = "lxml"
+SEARCH_NOT_FOUND = 0
+
+SL_ALTERNATE = sv.compile('link[rel="alternate"][hreflang="es"][href]')
+SL_SEARCH_RESULT = sv.compile("div.searchres div.card-body")
+SL_SEARCH_YEAR = sv.compile("span.mc-year")
+SL_HREF = sv.compile("a[href]")
+SL_POSTER = sv.compile("#movie-main-image-container img, #main-poster img")
+SL_COUNTRY = sv.compile("dl.movie-info span#country-img img, dl img.nflag")
+SL_REVIEWS = sv.compile("#movie-reviews-box")
+SL_GENRES = sv.compile("dd.card-genres a")
+
+# campo: (itemprop, tags admitidos, tag padre, atributo con el valor)
+ITEMPROPS: dict[str, tuple[str, tuple[str, ...], str | None, str | None]] = {
+    "title": ("name", ("span", ), "h1", None),
+    "year": ("datePublished", ("dd", "span"), None, None),
+    "duration": ("duration", ("dd", "span"), None, None),
+    "rate": ("ratingValue", (), None, "content"),
+    "votes": ("ratingCount", (), None, "content"),
+}
+ITEMPROP_FIELD: dict[str, str] = {v[0]: k for k, v in ITEMPROPS.items()}
 
 
 class FilmAffinityError(ValueError):
     pass
 
 
-def _get_soup(url: str):
-    soup = buildSoup(url, FM_SCRAPER.get(url).text)
+class FilmAffinityTooManyRequest(FilmAffinityError):
+    pass
+
+
+def _get_html(url: str):
+    html = FM_SCRAPER.get(url).text
     title_none = "not title found"
-    txt = get_text(soup.select_one("title")) or title_none
-    if txt.lower() in (title_none, "too many request", ):
+    m = re_title.search(html)
+    txt = re_sp.sub(" ", m.group(1)).strip() if m else ""
+    txt = txt or title_none
+    if txt.lower() == "too many request":
+        raise FilmAffinityTooManyRequest(txt)
+    if txt.lower() == title_none:
         raise FilmAffinityError(txt)
-    return soup
+    return html
+
+
+def _get_soup(url: str):
+    return buildSoup(url, _get_html(url), parser=FM_PARSER)
 
 
 @StaticCache("cache/filmaffinity/{}.html")
 def _get_html_from_id(id: int):
     url = f"https://www.filmaffinity.com/es/film{id}.html"
-    soup = _get_soup(url)
-    return str(soup)
+    return _get_html(url)
 
 
 def get_text(n: Tag | None) -> str | None:
@@ -112,11 +162,8 @@ class FilmAffinityApi:
         if not isinstance(body, str):
             return set()
         ok: set[int] = set()
-        for re_f in (
-            r"filmaffinity\.com/[a-z]+/film(\d+).html",
-            r'"filmaffinity"\s*:\s*(\d+)'
-        ):
-            ok.update(map(int, re.findall(re_f, body)))
+        for re_f in re_scrape:
+            ok.update(map(int, re_f.findall(body)))
         logger.debug(f"{len(ok)} ids en {url}")
         return ok
 
@@ -146,31 +193,48 @@ class FilmAffinityApi:
     def search(year: int, *titles: str):
         if not FilmAffinityApi.ACTIVE:
             return None
+        norm: list[str] = []
+        for t in titles:
+            t = re_sp.sub(" ", t or '').strip().lower()
+            if t and t not in norm:
+                norm.append(t)
         try:
-            ids: set[int] = set()
-            for title in titles:
-                url = "https://www.filmaffinity.com/es/search.php?stype=title&em=1&stext="+quote(title)
-                soup = _get_soup(url)
-                link = soup.select_one('link[rel="alternate"][hreflang="es"][href]')
-                _id_ = FilmAffinityApi.__extract_id_from_link(link)
-                if _id_:
-                    fm = FilmAffinityApi(_id_, soup)
-                    if fm.get_year() == year:
-                        ids.add(fm.id)
-                for div in soup.select("div.searchres div.card-body"):
-                    span = get_text(div.select_one("span.mc-year"))
-                    if span is None or int(span) != year:
-                        continue
-                    link = div.select_one("a[href]")
-                    _id_ = FilmAffinityApi.__extract_id_from_link(link)
-                    if _id_:
-                        ids.add(_id_)
-            if len(ids) == 1:
-                return FilmAffinityApi(ids.pop())
-        except FilmAffinityError as e:
+            _id_ = FilmAffinityApi.__search_id(year, *sorted(norm))
+            if _id_ != SEARCH_NOT_FOUND:
+                return FilmAffinityApi(_id_)
+        except FilmAffinityTooManyRequest as e:
             logger.critical(f"Error fetching film {year} {titles}: {e}")
             FilmAffinityApi.ACTIVE = False
             return None
+        except FilmAffinityError as e:
+            logger.warning(f"Error fetching film {year} {titles}: {e}")
+            return None
+
+    @StaticHashCache("out/filmaffinity/search/{}.json", maxOld=30)
+    @staticmethod
+    def __search_id(year: int, *titles: str) -> int:
+        ids: set[int] = set()
+        for title in titles:
+            url = "https://www.filmaffinity.com/es/search.php?stype=title&em=1&stext="+quote(title)
+            soup = _get_soup(url)
+            link = SL_ALTERNATE.select_one(soup)
+            _id_ = FilmAffinityApi.__extract_id_from_link(link)
+            if _id_:
+                fm = FilmAffinityApi(_id_, soup)
+                if fm.get_year() == year:
+                    ids.add(fm.id)
+            for div in SL_SEARCH_RESULT.select(soup):
+                span = get_text(SL_SEARCH_YEAR.select_one(div))
+                if span is None or int(span) != year:
+                    continue
+                link = SL_HREF.select_one(div)
+                _id_ = FilmAffinityApi.__extract_id_from_link(link)
+                if _id_:
+                    ids.add(_id_)
+        if len(ids) == 1:
+            return ids.pop()
+        # se guarda en cache para no repetir la búsqueda hasta que caduque
+        return SEARCH_NOT_FOUND
 
     @staticmethod
     def __extract_id_from_link(a: Tag):
@@ -179,10 +243,13 @@ class FilmAffinityApi:
         href = a.attrs.get("href")
         if not isinstance(href, str):
             return None
-        m = re.search(r"/film(\d+)\.html$", href)
-        if m is None:
+        _, film, tail = href.rpartition("/film")
+        if not film or not tail.endswith(".html"):
             return None
-        return int(m.group(1))
+        num = tail[:-5]
+        if not num.isdecimal():
+            return None
+        return int(num)
 
     @property
     def id(self) -> int:
@@ -198,46 +265,71 @@ class FilmAffinityApi:
             return None
         try:
             return FilmAffinityApi(int(id))
-        except FilmAffinityError as e:
+        except FilmAffinityTooManyRequest as e:
             logger.critical(f"Error fetching film {id}: {e}")
             FilmAffinityApi.ACTIVE = False
             return None
+        except FilmAffinityError as e:
+            logger.warning(f"Error fetching film {id}: {e}")
+            return None
 
     def __init__(self, id: int, soup: Optional[Tag] = None):
         self.__id = id
         self.__soup = soup
         if self.__soup is None:
             html = _get_html_from_id(id)
-            self.__soup = BeautifulSoup(html, "html.parser")
+            self.__soup = buildSoup(self.url, html, parser=FM_PARSER)
 
-    def __get_attr(self, slc: str, attr: str) -> str | None:
-        n = self.__soup.select_one(slc)
+    def __get_attr(self, slc: sv.SoupSieve, attr: str) -> str | None:
+        n = slc.select_one(self.__soup)
         if n is not None:
             val = re_sp.sub(" ", n.attrs.get(attr) or '')
             if len(val):
                 return val
-        logger.critical(f"Valor no encontrado: {slc}[{attr}] {self.url}")
+        logger.critical(f"Valor no encontrado: {slc.pattern}[{attr}] {self.url}")
 
     def get_poster(self) -> str:
-        return self.__get_attr("#movie-main-image-container img, #main-poster img", "src")
+        return self.__get_attr(SL_POSTER, "src")
+
+    @cached_property
+    def __itemprops(self) -> dict[str, str | None]:
+        values: dict[str, str | None] = {}
+        for n in self.__soup.find_all(attrs={"itemprop": True}):
+            field = ITEMPROP_FIELD.get(n.attrs["itemprop"])
+            if field is None or field in values:
+                continue
+            _, tags, parent, attr = ITEMPROPS[field]
+            if tags and n.name not in tags:
+                continue
+            if parent is not None and n.find_parent(parent) is None:
+                continue
+            if attr is None:
+                values[field] = get_text(n)
+                continue
+            val = n.attrs.get(attr)
+            if val is None:
+                continue
+            if isinstance(val, str):
+                val = re_sp.sub(" ", val).strip() or None
+            values[field] = val
+        return values
 
     def get_title(self) -> str:
-        return get_text(self.__soup.select_one("h1 span[itemprop='name']"))
+        return self.__itemprops.get("title")
 
     def get_year(self) -> str:
-        y = get_text(self.__soup.select_one("dd[itemprop='datePublished'], span[itemprop='datePublished']"))
+        y = self.__itemprops.get("year")
         if y and y.isdecimal():
             return int(y)
 
     def get_duration(self) -> str:
-        y = get_text(self.__soup.select_one("dd[itemprop='duration'], span[itemprop='duration']"))
-        if y and re.match(r"^\d+ min\.?$", y):
+        y = self.__itemprops.get("duration")
+        if y and re_min.match(y):
             return int(y.split()[0])
 
     def get_country(self) -> str | None:
-        slc = "dl.movie-info span#country-img img, dl img.nflag"
-        src = self.__get_attr(slc, "src")
-        alt = self.__get_attr(slc, "alt")
+        src = self.__get_attr(SL_COUNTRY, "src")
+        alt = self.__get_attr(SL_COUNTRY, "alt")
         if (src, alt) == (None, None):
             logger.warning(f"Bandera no encontrada en {self.url}")
             return None
@@ -254,40 +346,33 @@ class FilmAffinityApi:
         logger.critical(f"Código alpha3 de país no encontrado: cod={cod} alt={alt} {self.url}")
 
     def get_rate(self) -> float | None:
-        return self.__get_itemprop("ratingValue", to=float)
+        return self.__get_itemprop("rate", to=float)
 
     def get_votes(self) -> int:
-        v = self.__get_itemprop("ratingCount", to=int)
+        v = self.__get_itemprop("votes", to=int)
         if v is None:
             return 0
         return v
 
     def get_reviews(self) -> int | None:
-        txt_reviews = get_text(self.__soup.select_one("#movie-reviews-box"))
-        if not isinstance(txt_reviews, str) or not re.match(r"^\d+\s+.*$", txt_reviews):
+        txt_reviews = get_text(SL_REVIEWS.select_one(self.__soup))
+        if not isinstance(txt_reviews, str) or not re_reviews.match(txt_reviews):
             return 0
         return int(txt_reviews.split()[0])
 
     def get_genres(self):
         arr: list[str] = []
-        for g in map(get_text, self.__soup.select(f'dd.card-genres a')):
+        for g in map(get_text, SL_GENRES.select(self.__soup)):
             if g and g not in arr:
                 arr.append(g)
         if len(arr) == 0:
             return None
         return tuple(arr)
 
-    def __get_itemprop(self, name: str, to: type):
-        n = self.__soup.select_one(f'*[itemprop="{name}"][content]')
-        if n is None:
-            return None
-        c = n.attrs.get('content')
+    def __get_itemprop(self, field: str, to: type):
+        c = self.__itemprops.get(field)
         if c is None:
             return None
-        if isinstance(c, str):
-            c = re_sp.sub(" ", c).strip()
-            if len(c) == 0:
-                return None
         return to(c) if to else c
 
 
@@ -1,21 +1,45 @@
 from os import environ
+from time import time
 import logging
 from core.cache import Cache
-from functools import cache, cached_property
+from functools import cache
 import re
 from typing import NamedTuple
+try:
+    import re2 as re_fast
+except ImportError:
+    re_fast = re
 from core.req import R
 from core.wiki import WIKI, WikiImdbCountry
 from core.country import CF
-from core.util import safe_num, tp_split, safe_str
+from core.util import safe_num, tp_split, safe_str, get_env, iter_parallel
 from urllib.error import HTTPError
 from core.git import G
 from core.filemanager import FM
-from datetime import datetime
 
 
 logger = logging.getLogger(__name__)
 re_sp = re.compile(r"\s+")
+re_title = re.compile(r"<title>(.*?)\s*-\s*IMDb\s*</title>", re.IGNORECASE | re.DOTALL)
+re_tt = re_fast.compile(r"\btt\d+")
+OMDBAPI_PARALLEL = int(get_env('OMDBAPI_PARALLEL', default='8'))
+# imdb.com es otro host, con otros límites: pocas peticiones a la vez
+IMDB_PARALLEL = int(get_env('IMDB_PARALLEL', default='2'))
+
+
+def _find_title(html: str) -> str | None:
+    ini = html.find("<title>")
+    end = html.find("</title>", ini)
+    if ini >= 0 and end >= 0:
+        title = html[ini+7:end].rstrip()
+        if title.endswith("IMDb"):
+            title = title[:-4].rstrip()
+            if title.endswith("-"):
+                return title[:-1].strip()
+    match = re_title.search(html)
+    if match:
+        return match.group(1).strip()
+    return None
 
 
 class Movie(NamedTuple):
@@ -29,28 +53,46 @@ class Movie(NamedTuple):
 
 
 class IMDBApi:
+    __slots__ = ('__omdbapi_activate', '__omdbapi_url')
+
     def __init__(self):
         self.__omdbapi_activate = True
+        self.__omdbapi_url: str | None = None
 
-    @cached_property
+    @property
     def __omdbapi(self):
+        if self.__omdbapi_url is None:
+            self.__omdbapi_url = self.__get_omdbapi_url()
+        return self.__omdbapi_url
+
+    def __get_omdbapi_url(self):
         keys = tp_split(" ", environ.get('OMDBAPI_KEY'))
         if len(keys) == 0:
             raise ValueError("Variable OMDBAPI_KEY no definida correctamente")
         path = "ip_index.json"
         target = f"out/{path}"
-        ip_index = FM.dwn_json(f"{G.page}/{path}", target, default={})
+        ip_index = self.__load_ip_index(f"{G.page}/{path}", target)
         index: int = ip_index.get(R.ip, -1)
         if index < 0:
             index = ip_index.get('', -1) + 1
         index = index % len(keys)
         logger.info(f"{R.ip} le corresponde la key nº {index}")
-        ip_index[''] = index
-        ip_index[R.ip] = index
-        FM.dump(target, ip_index)
+        if ip_index.get('') != index or ip_index.get(R.ip) != index:
+            ip_index[''] = index
+            ip_index[R.ip] = index
+            FM.dump(target, ip_index)
         k = keys[index]
         return f"http://www.omdbapi.com/?apikey={k}&i="
 
+    def __load_ip_index(self, url: str, target: str) -> dict[str, int]:
+        refresh = get_env('OMDBAPI_REFRESH_IP_INDEX') not in (None, '0')
+        file = FM.resolve_path(target)
+        if not refresh and file.is_file() and file.stat().st_mtime > time() - 86400:
+            ip_index = FM.load(target)
+            if isinstance(ip_index, dict):
+                return ip_index
+        return FM.dwn_json(url, target, default={})
+
     @cache
     @Cache("out/omdb/{}.json", maxOld=90)
     def __get_from_omdbapi(self, id: str) -> dict | None:
@@ -74,9 +116,20 @@ class IMDBApi:
         if response not in (True, 'True', 'true'):
             logger.warning(f"IMDBApi: {id} Response = {response}")
             return None
-        js['__time__'] = datetime.now().isoformat()
+        js['__time__'] = time()
         return js
 
+    def __warm_omdbapi(self, *ids: str):
+        cch: Cache = self.__get_from_omdbapi.__cache_obj__
+        missing = [i for i in ids if i and cch.tooOld(cch.parse_file_name(i))]
+        if len(missing) < 2 or not self.__omdbapi_activate:
+            return
+        logger.info(f"OMDb: {len(missing)} ids en {OMDBAPI_PARALLEL} hilos")
+        # la key se resuelve en el hilo principal antes de lanzar el pool
+        self.__omdbapi
+        for _ in iter_parallel(OMDBAPI_PARALLEL, self.__get_from_omdbapi, missing):
+            pass
+
     def get_from_omdbapi(self, id: str):
         if id in (None, ""):
             return None
@@ -96,24 +149,20 @@ class IMDBApi:
         html = R.get_body(url, headers=headers, chances=3)
         if html is None:
             return None
-        match = re.search(
-            r"<title>(.*?)\s*-\s*IMDb\s*</title>",
-            html,
-            re.IGNORECASE | re.DOTALL
-        )
-        if not match:
+        title = _find_title(html)
+        if title is None:
             logger.warning(f"[KO] {url} NOT TITLE")
             return None
-        title = match.group(1).strip()
         if title in ("IMDb, an Amazon company", ''):
             logger.warning(f"[KO] {url} BAD TITLE: {title}")
             return None
         return title
 
     def get_names(self, *ids):
+        ids = tuple(sorted(set(i for i in ids if i)))
         id_name = WIKI.get_names(*ids)
-        for i in set(ids).difference(id_name.keys()):
-            name = self.__get_name(i)
+        missing = sorted(set(ids).difference(id_name.keys()))
+        for i, name in iter_parallel(IMDB_PARALLEL, self.__get_name, missing):
             if name:
                 id_name[i] = name
         return id_name
@@ -128,13 +177,13 @@ class IMDBApi:
         body = R.get_body(url)
         if not isinstance(body, str):
             return set()
-        ok = set(re.findall(r"\btt\d+", body))
+        ok = {m.group() for m in re_tt.finditer(body)}
         logger.debug(f"{len(ok)} ids en {url}")
         return ok
 
     def scrape(self, *urls: str):
         ids: set[str] = set()
-        for u in urls:
+        for u in sorted(set(u for u in urls if u)):
             ids.update(self.__scrape(u))
         return tuple(sorted(ids))
 
@@ -150,8 +199,10 @@ class IMDBApi:
         return tuple(ctr)
 
     def get_countries(self, *ids):
+        ids = tuple(sorted(set(i for i in ids if i)))
         r: dict[str, str] = {}
         wiki_data = WIKI.get_countries(*ids)
+        self.__warm_omdbapi(*ids)
         for i in ids:
             wd = wiki_data.get(i)
             om = self.__get_countries(i)
@@ -170,21 +221,28 @@ class IMDBApi:
             ok_lang = set(main).intersection(wd.country_lang)
             if ok_lang:
                 main = ok_lang
-        order: dict[str, tuple[int, ...]] = {}
-        for m in main:
-            order[m] = (
+        scored = sorted(
+            ((m, (
                 int(m in wd.country_lang),
                 wd.producer.get(m, 0),
                 wd.director.get(m, 0),
                 wd.writer.get(m, 0),
                 wd.casting.get(m, 0),
-            )
-        index_threshold = 3
-        sorted_order = sorted(set(order.values()), reverse=True)
-        if len(sorted_order) > index_threshold:
-            threshold = sorted_order[index_threshold-1]
-            main = [m for m in main if order[m] >= threshold]
-        return tuple(sorted(main, key=lambda x: order[x], reverse=True))
+            )) for m in main),
+            key=lambda x: x[1],
+            reverse=True
+        )
+        levels = 3
+        ctr: list[str] = []
+        last: tuple[int, ...] | None = None
+        for m, order in scored:
+            if order != last:
+                levels = levels - 1
+                if levels < 0:
+                    break
+                last = order
+            ctr.append(m)
+        return tuple(ctr)
 
     def get(self, id: str):
         obj = self.get_from_omdbapi(id)
@@ -1,35 +1,64 @@
-from urllib.request import Request, urlopen
+from urllib.request import urlopen
 from urllib.error import URLError, HTTPError
 from socket import timeout
 from functools import cache, cached_property
 import logging
-import json
+import orjson
 import gzip
 from io import TextIOWrapper
 import csv
-from http.client import HTTPResponse
+import re
 from time import sleep
 from json.decoder import JSONDecodeError
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
+re_charset = re.compile(r"charset=[\"']?([^;\s\"']+)", re.IGNORECASE)
 
 
 class Req:
+    def __init__(self):
+        self.__session = Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=1,
+                status_forcelist=(502, 503),
+                raise_on_status=False
+            )
+        )
+        self.__session.mount("https://", adapter)
+        self.__session.mount("http://", adapter)
+
+    @property
+    def session(self):
+        return self.__session
 
     @cache
     def __get_body(self, url: str, headers: frozenset = None, data: bytes = None) -> str:
-        req = Request(
-            url,
-            headers=dict(headers or frozenset()),
-            data=data
-        ) if headers or data else url
-        r: HTTPResponse
-        with urlopen(req) as r:
-            charset: str = r.headers.get_content_charset() or 'utf-8'
-            body: str = r.read().decode(charset, errors="replace")
-            body = body.strip()
-            if len(body):
-                return body
+        try:
+            r = self.__session.request(
+                "GET" if data is None else "POST",
+                url,
+                headers=dict(headers or frozenset()),
+                data=data,
+                timeout=120
+            )
+        except RequestException as e:
+            raise URLError(e) from e
+        if r.status_code >= 400:
+            raise HTTPError(url, r.status_code, r.reason, r.headers, None)
+        m = re_charset.search(r.headers.get("Content-Type") or '')
+        charset: str = m.group(1) if m else 'utf-8'
+        body: str = r.content.decode(charset, errors="replace")
+        body = body.strip()
+        if len(body):
+            return body
 
     @cached_property
     def ip(self):
@@ -59,11 +88,14 @@ class Req:
         frz = frozenset(headers.items()) if headers else None
         try:
             body = self.__get_body(url, headers=frz, data=data)
-            return json.loads(body)
+            return orjson.loads(body)
         except HTTPError as e:
             wait = (wait_if_status or {}).get(e.code, 0)
             if wait <= 0:
                 raise
+            retry_after = (e.headers or {}).get("Retry-After")
+            if isinstance(retry_after, str) and retry_after.strip().isdecimal():
+                wait = int(retry_after)
         sleep(wait)
         return self.get_json(url, headers, data, wait_if_status=tuple())
 
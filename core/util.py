@@ -2,11 +2,13 @@ import re
 from os import environ
 from bs4 import BeautifulSoup, Tag
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache
+from itertools import islice
 
 re_sp = re.compile(r"\s+")
 re_emb = re.compile(r"^image/[^;]+;base64,.*", re.IGNORECASE)
-
-re_sp = re.compile(r"\s+")
+re_min = re.compile(r"^(\d+)\s+min$")
 
 
 def safe_num(s: str, default: int | float = None):
@@ -19,19 +21,29 @@ def safe_num(s: str, default: int | float = None):
         return default
     if s.isdecimal():
         return int(s)
-    if re.match(r"^\d+\.\d+$", s):
+    num, dot, dec = s.partition(".")
+    if dot and num.isdecimal() and dec.isdecimal():
         return float(s)
-    m = re.match(r"^(\d+)\s+min$", s)
-    if m:
-        return int(m.group(1))
+    if s.endswith("min"):
+        m = re_min.match(s)
+        if m:
+            return int(m.group(1))
     return default
 
 
+@lru_cache(maxsize=1024)
+def _clean_str(s: str) -> str | None:
+    s = re_sp.sub(" ", s).strip()
+    if s in ('', 'N/A'):
+        return None
+    return s
+
+
 def safe_str(s: str, default: str = None):
     if not isinstance(s, str):
         return default
-    s = re_sp.sub(" ", s).strip()
-    if s in ('', 'N/A'):
+    s = _clean_str(s)
+    if s is None:
         return default
     return s
 
@@ -44,10 +56,16 @@ def uniq(*args: str | None):
     return arr
 
 
+@cache
+def _re_split(sep: str) -> re.Pattern:
+    return re.compile(r"\s*"+re.escape(sep)+r"\s*")
+
+
+@lru_cache(maxsize=1024)
 def tp_split(sep: str, s: str) -> tuple[str, ...]:
     if s is None:
         return tuple()
-    spl = re.split(r"\s*"+re.escape(sep)+r"\s*", s)
+    spl = _re_split(sep).split(s)
     return tuple(uniq(*spl))
 
 
@@ -62,15 +80,24 @@ def get_env(*args: str, default: str = None) -> str | None:
 
 
 def iter_chunk(size: int, args: list):
-    arr = []
-    for a in args:
-        arr.append(a)
-        if len(arr) == size:
-            yield arr
-            arr = []
-    if arr:
+    it = iter(args)
+    while True:
+        arr = tuple(islice(it, size))
+        if not arr:
+            return
         yield arr
 
+
+def iter_parallel(max_workers: int, func, args: list):
+    """Aplica func a cada elemento de args en un pool de hilos y devuelve (arg, resultado) en orden"""
+    args = list(args)
+    if max_workers <= 1 or len(args) <= 1:
+        yield from zip(args, map(func, args))
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from zip(args, executor.map(func, args))
+
+
 def iterhref(soup: BeautifulSoup):
     """Recorre los atributos href o src de los tags"""
     n: Tag
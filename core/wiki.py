@@ -1,29 +1,63 @@
 from textwrap import dedent
 import logging
-from typing import Any, NamedTuple, Optional
+from typing import Any, Callable, Iterator, NamedTuple, Optional
 from functools import cache
 import re
-from time import sleep
+from time import sleep, time
+from random import random
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import wraps
 from core.git import G
-from core.req import R
-from collections import defaultdict
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from collections import defaultdict, Counter
+from itertools import chain
 from datetime import datetime, timedelta
-from core.util import iter_chunk
-from urllib.error import HTTPError
+from core.util import iter_chunk, get_env
 from core.country import CF
 import json
-from requests import Session
+import orjson
 from types import MappingProxyType
+from core.cache import DictCache, sha256_hash
 
 
 logger = logging.getLogger(__name__)
 re_sp = re.compile(r"\s+")
 LANGS = ('es', 'en', 'ca', 'gl', 'it', 'fr')
+SPARQL_URL = "https://query.wikidata.org/sparql"
+# dias que se recuerdan los ids sin resultado en una consulta correcta
+MISS_MAX_OLD = 3
+CACHE_BUST = get_env('WIKI_CACHE_BUST') not in (None, '0')
 
 re_imdb = re.compile(r"^tt\d+$")
 re_fiml = re.compile(r"^\d+$")
 re_wiki_url = re.compile(r"^https://\w\.wikipedia\.org/wiki/\S+$")
+COUNTRY_PATHS = {
+    "main": "wdt:P495",
+    "prod": "wdt:P272/wdt:P17",
+    "dire": "wdt:P57/wdt:P27",
+    "writ": "wdt:P58/wdt:P27",
+    "acto": "wdt:P161/wdt:P27",
+}
+re_blank = re.compile(r"\n(\s*\n)+")
+re_entity = re.compile(r"https?://www\.wikidata\.org/entity/(Q\d+)")
+WD_GENID = "http://www.wikidata.org/.well-known/genid/"
+WD_ENTITY = ("http://www.wikidata.org/entity/Q", "https://www.wikidata.org/entity/Q")
+Validator = re.Pattern | Callable[[str], bool]
+
+
+@cache
+def _lang_priority(lang: tuple[str, ...]) -> tuple[str, dict[str, int]]:
+    lang_filter = ", ".join(f'"{lg}"' for lg in lang)
+    return lang_filter, {lg: i for i, lg in enumerate(lang, start=1)}
+
+
+@cache
+def _template(query: str) -> str:
+    query = dedent(query).strip()
+    return re_blank.sub("\n", query)
 
 
 def _parse_wiki_val(s):
@@ -32,20 +66,52 @@ def _parse_wiki_val(s):
     s = s.strip()
     if len(s) == 0:
         return None
-    if s.startswith("http://www.wikidata.org/.well-known/genid/"):
+    if s.startswith(WD_GENID):
         return None
-    m = re.match(r"https?://www\.wikidata\.org/entity/(Q\d+)", s)
+    if not s.startswith(WD_ENTITY):
+        return s
+    q = s.partition("/entity/")[2]
+    if q[1:].isdecimal():
+        return "wd:" + q
+    m = re_entity.match(s)
     if m:
         return f"wd:{m.group(1)}"
     return s
 
 
+def _is_imdb(s: str) -> bool:
+    return s.startswith("tt") and s[2:].isdecimal()
+
+
+# equivalentes sin regex de los patrones más usados
+FAST_MATCH: dict[re.Pattern, Callable[[str], bool]] = {
+    re_imdb: _is_imdb,
+    re_fiml: str.isdecimal,
+}
+
+
+def _matcher(v: Optional[Validator]) -> Optional[Callable[[str], bool]]:
+    if v is None:
+        return None
+    if isinstance(v, re.Pattern):
+        return FAST_MATCH.get(v, v.match)
+    return v
+
+
+def _retry_after(resp) -> float | None:
+    retry_after = (resp.headers.get("Retry-After") or "").strip()
+    if retry_after.isdecimal():
+        return float(retry_after)
+    return None
+
+
 class WikiError(Exception):
-    def __init__(self, msg: str, query: str, http_code: int):
+    def __init__(self, msg: str, query: str, http_code: int = None, retry_after: float = None):
         super().__init__(f"{msg}\n{query}")
         self.__query = query
         self.__msg = msg
         self.__http_code = http_code
+        self.__retry_after = retry_after
 
     @property
     def msg(self):
@@ -59,6 +125,10 @@ class WikiError(Exception):
     def query(self):
         return self.__query
 
+    @property
+    def retry_after(self):
+        return self.__retry_after
+
 
 class WikiImdbCountry(NamedTuple):
     imdb: str
@@ -72,7 +142,10 @@ class WikiImdbCountry(NamedTuple):
 
 def retry_fetch(chunk_size=5000):
     def decorator(func):
-        internal_cache: dict[tuple[str, str], Any] = {}
+        internal_cache: dict[tuple, dict[str, Any]] = defaultdict(dict)
+        disk_cache: dict[tuple, tuple[DictCache, DictCache]] = {}
+        # varios hilos pueden llamar a la vez a la misma función decorada
+        cache_lock = Lock()
 
         @wraps(func)
         def wrapper(self: "WikiApi", *args, **kwargs):
@@ -83,14 +156,34 @@ def retry_fetch(chunk_size=5000):
             for k, v in kwargs.items():
                 if isinstance(v, re.Pattern):
                     v = (v.pattern, v.flags)
+                elif callable(v):
+                    v = v.__qualname__
                 kwargs_to_json[k] = v
-            key_cache = json.dumps((func.__name__, kwargs_to_json), sort_keys=True)
-            result = dict()
-            for a in undone:
-                val = internal_cache.get((key_cache, a))
-                if val is not None:
-                    result[a] = val
-                    undone.discard(a)
+            key_cache = (func.__name__, tuple(sorted(
+                (k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs_to_json.items()
+            )))
+            with cache_lock:
+                if key_cache not in disk_cache:
+                    key_json = json.dumps((func.__name__, kwargs_to_json), sort_keys=True)
+                    path = f"out/wiki/{func.__name__.strip('_')}/{sha256_hash(key_json)}"
+                    disk_cache[key_cache] = (
+                        DictCache(f"{path}.json"),
+                        DictCache(f"{path}.miss.json", maxOld=MISS_MAX_OLD)
+                    )
+                    if CACHE_BUST:
+                        for dc in disk_cache[key_cache]:
+                            dc.clear()
+                disk, miss = disk_cache[key_cache]
+                mem = internal_cache[key_cache]
+                hits = mem.keys() & undone
+                result = {a: mem[a] for a in hits}
+                undone.difference_update(hits)
+                hits = disk.data.keys() & undone
+                for a in hits:
+                    mem[a] = result[a] = disk.get(a)
+                undone.difference_update(hits)
+                undone.difference_update(miss.data.keys())
+            answered: set[str] = set()
 
             def _log_line(rgs: tuple, kw: dict, ck: int):
                 rgs = sorted(set(rgs))
@@ -101,6 +194,17 @@ def retry_fetch(chunk_size=5000):
                 )
                 return f"{func.__name__}({line})"
 
+            backoff_lock = Lock()
+            backoff_until = 0.0
+            server_errors = 0
+
+            def _fetch(chunk: tuple[str, ...]):
+                with backoff_lock:
+                    wait = backoff_until - time()
+                if wait > 0:
+                    sleep(wait)
+                return func(self, *chunk, **kwargs)
+
             error_query = {}
             count = 0
             tries = 0
@@ -113,28 +217,56 @@ def retry_fetch(chunk_size=5000):
                     cur_chunk_size = max(1, min(cur_chunk_size, len(undone)) // 3)
                     sleep(5)
                 logger.info(_log_line(undone, kwargs, cur_chunk_size))
-                for chunk in iter_chunk(cur_chunk_size, list(undone)):
-                    count += 1
-                    fetched: dict = None
-                    try:
-                        fetched = func(self, *chunk, **kwargs) or {}
-                        fetched = {k: v for k, v in fetched.items() if v}
-                    except WikiError as e:
-                        logger.warning(f"└ [KO] {e.msg}")
-                        if e.http_code == 429:
-                            sleep(60)
-                        elif e.http_code is not None:
-                            last_error = error_query.get(e.http_code)
-                            if last_error is None or len(last_error) > len(e.query):
-                                error_query[e.http_code] = str(e.query)
-                    if not fetched:
-                        continue
-                    for k, v in fetched.items():
-                        result[k] = v
-                        internal_cache[(key_cache, k)] = v
-                        undone.remove(k)
-                    logger.debug(f"└ [{count}] [{chunk[0]} - {chunk[-1]}] = {len(fetched)} items")
-
+                chunks = list(iter_chunk(cur_chunk_size, sorted(undone)))
+                executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks)))
+                try:
+                    futures = {executor.submit(_fetch, chunk): chunk for chunk in chunks}
+                    for future in as_completed(futures):
+                        chunk = futures[future]
+                        count += 1
+                        fetched: dict = None
+                        try:
+                            fetched = future.result() or {}
+                            fetched = {k: v for k, v in fetched.items() if v}
+                            answered.update(chunk)
+                        except WikiError as e:
+                            logger.warning(f"└ [KO] {e.msg}")
+                            if e.http_code == 429:
+                                with backoff_lock:
+                                    backoff_until = max(backoff_until, time() + (e.retry_after or 60))
+                            elif e.http_code is not None and e.http_code >= 500:
+                                wait = e.retry_after or min(60, 2 ** server_errors) + random()
+                                server_errors = server_errors + 1
+                                with backoff_lock:
+                                    backoff_until = max(backoff_until, time() + wait)
+                            if e.http_code not in (None, 429):
+                                last_error = error_query.get(e.http_code)
+                                if last_error is None or len(last_error) > len(e.query):
+                                    error_query[e.http_code] = str(e.query)
+                        if not fetched:
+                            continue
+                        with cache_lock:
+                            for k, v in fetched.items():
+                                result[k] = v
+                                mem[k] = v
+                                disk.set(k, v)
+                        undone.difference_update(fetched.keys())
+                        logger.debug(f"└ [{count}] [{chunk[0]} - {chunk[-1]}] = {len(fetched)} items")
+                except BaseException:
+                    # no se espera a los chunks pendientes si algo falla
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                executor.shutdown()
+                with backoff_lock:
+                    wait = backoff_until - time()
+                if wait > 0:
+                    sleep(wait)
+
+            with cache_lock:
+                for a in answered.intersection(undone):
+                    miss.set(a, 1)
+                disk.save()
+                miss.save()
             logger.info(f"{_log_line(args, kwargs, chunk_size)} = {len(result)} items")
             for c, q in error_query.items():
                 logger.warning(f"STATUS_CODE {c} for:\n{q}")
@@ -145,72 +277,91 @@ def retry_fetch(chunk_size=5000):
 
 
 class WikiApi:
-    def __init__(self):
+    __slots__ = ('__headers', '__sparql', '__max_workers', '__semaphore')
+
+    def __init__(self, max_workers: int = 4):
         # https://foundation.wikimedia.org/wiki/Policy:Wikimedia_Foundation_User-Agent_Policy
         self.__headers = {
             'User-Agent': f'ImdbBoot/0.0 ({G.remote}; {G.mail})',
             "Accept": "application/sparql-results+json",
             'Content-Type': 'application/sparql-query'
         }
-        self.__last_query: str | None = None
-        self.__tsv = Session()
-        self.__tsv.headers = {
-            'User-Agent': f'ImdbBoot/0.0 ({G.remote}; {G.mail})',
-            "Accept": "text/tab-separated-values",
-        }
+        self.__max_workers = max(1, max_workers)
+        self.__semaphore = BoundedSemaphore(self.__max_workers)
+        self.__sparql = Session()
+        self.__sparql.headers.update(self.__headers)
+        self.__sparql.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.__sparql.mount("https://", HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=0
+        ))
 
     @property
-    def last_query(self):
-        return self.__last_query
+    def max_workers(self):
+        return self.__max_workers
 
     def query_sparql(self, query: str) -> dict:
         # https://query.wikidata.org/
-        query = dedent(query).strip()
-        query = re.sub(r"\n(\s*\n)+", "\n", query)
-        self.__last_query = query
-        try:
-            return R.get_json(
-                "https://query.wikidata.org/sparql",
-                headers=self.__headers,
-                data=self.__last_query.encode('utf-8'),
-                wait_if_status={429: 60}
+        query = query.strip()
+        data = query.encode('utf-8')
+        for wait in (60, None):
+            try:
+                with self.__semaphore:
+                    resp = self.__sparql.post(SPARQL_URL, data=data, timeout=120)
+            except RequestException as e:
+                raise WikiError(str(e), query, http_code=None) from e
+            if resp.status_code != 429 or wait is None:
+                break
+            sleep(_retry_after(resp) or wait)
+        if resp.status_code != 200:
+            raise WikiError(
+                f"HTTP Error {resp.status_code}: {resp.reason}",
+                query,
+                http_code=resp.status_code,
+                retry_after=_retry_after(resp)
             )
-        except Exception as e:
-            code = e.code if isinstance(e, HTTPError) else None
-            raise WikiError(str(e), self.__last_query, http_code=code) from e
+        try:
+            return orjson.loads(resp.content)
+        except ValueError as e:
+            raise WikiError(str(e), query, http_code=None) from e
 
-    def query(self, query: str, page_size: int = None) -> list[dict[str, Any]]:
+    def query(self, query: str, page_size: int = None) -> Iterator[dict[str, Any]]:
         if page_size is None:
-            return self.__query(query)
+            yield from self.__query(query)
+            return
         query = query + f"\nLIMIT {page_size}"
-        offset = -page_size
-        bindings = []
-        len_bak = -1
-        while len(bindings) > len_bak:
-            len_bak = len(bindings)
+        offset = 0
+        while True:
+            bindings = self.__query(query + f"\nOFFSET {offset}")
+            if len(bindings) == 0:
+                return
+            yield from bindings
             offset = offset + page_size
-            b = self.__query(query + f"\nOFFSET {offset}")
-            bindings.extend(b)
-        return bindings
 
     def __query(self, query: str) -> list[dict[str, Any]]:
+        query = query.strip()
         data = self.query_sparql(query)
         if not isinstance(data, dict):
-            raise WikiError(str(data), self.__last_query)
+            raise WikiError(str(data), query)
         result = data.get('results')
         if not isinstance(result, dict):
-            raise WikiError(str(data), self.__last_query)
+            raise WikiError(str(data), query)
         bindings = result.get('bindings')
         if not isinstance(bindings, list):
-            raise WikiError(str(data), self.__last_query)
+            raise WikiError(str(data), query)
         for i in bindings:
             if not isinstance(i, dict):
-                raise WikiError(str(data), self.__last_query)
+                raise WikiError(str(data), query)
             if i.get('subject') and i.get('object'):
-                raise WikiError(str(data), self.__last_query)
+                raise WikiError(str(data), query)
         return bindings
 
     def get_filmaffinity(self, *args):
+        return self.__get_filmaffinity(*sorted(set(a for a in args if a)))
+
+    @cache
+    def __get_filmaffinity(self, *args):
         obj = self.get_dict_1_to_1(
             *args,
             key_field='wdt:P345',
@@ -221,6 +372,10 @@ class WikiApi:
         return MappingProxyType({k: int(v) for k, v in obj.items()})
 
     def get_imdb(self, *args):
+        return self.__get_imdb(*sorted(set(a for a in args if a)))
+
+    @cache
+    def __get_imdb(self, *args):
         obj = self.get_dict_1_to_1(
             *args,
             key_field='wdt:P480',
@@ -247,50 +402,33 @@ class WikiApi:
 
     @retry_fetch(chunk_size=300)
     def get_label_dict(self, *args, key_field: str = None, lang: tuple[str] = None):
-        if not lang:
-            lang = LANGS
-
+        lang_filter, lang_priority = _lang_priority(tuple(lang or LANGS))
         values = " ".join(f'"{x}"' for x in args)
-
-        lang_priority = {lg: i for i, lg in enumerate(lang, start=1)}
-        lang_filter = ", ".join(f'"{lg}"' for lg in lang_priority)
-
-        lang_case = " ".join(
-            f'IF(LANG(?v) = "{lg}", {p},' for lg, p in lang_priority.items()
-        ) + f"{(len(lang_priority) + 1)})" + (')'* (len(lang_priority)-1))
-
-        query = dedent("""
+        query = _template("""
             SELECT ?k ?v WHERE {
                 VALUES ?k { %s }
                 ?item %s ?k ;
                     rdfs:label ?v .
                 FILTER(LANG(?v) IN (%s))
-
-                {
-                SELECT ?k (MIN(?pri) AS ?minPri) WHERE {
-                    VALUES ?k { %s }
-                    ?item %s ?k ;
-                        rdfs:label ?v .
-                    FILTER(LANG(?v) IN (%s))
-                    BIND(%s AS ?pri)
-                }
-                GROUP BY ?k
-                }
-
-                BIND(%s AS ?pri)
-                FILTER(?pri = ?minPri)
             }
-        """).strip() % (
-            values,
-            key_field,
-            lang_filter,
-            values,
-            key_field,
-            lang_filter,
-            lang_case,
-            lang_case,
-        )
-        return self.__get_dict_uniq_tuple(query)
+        """) % (values, key_field, lang_filter)
+
+        best: dict[str, int] = {}
+        r: dict[str, dict[str, None]] = defaultdict(dict)
+        for b in self.query(query):
+            vv = b.get('v') or {}
+            k = _parse_wiki_val((b.get('k') or {}).get('value'))
+            v = _parse_wiki_val(vv.get('value'))
+            pri = lang_priority.get(vv.get('xml:lang'))
+            if None in (k, v, pri):
+                continue
+            cur = best.get(k)
+            if cur is None or pri < cur:
+                best[k] = pri
+                r[k] = {v: None}
+            elif pri == cur:
+                r[k][v] = None
+        return {k: tuple(v) for k, v in r.items()}
 
     def __mk_query(
         self,
@@ -301,37 +439,37 @@ class WikiApi:
     ):
         ids = " ".join(map(lambda x: x if x.startswith("wd:") else f'"{x}"', args))
         if by_field:
-            query = dedent('''
+            query = _template('''
                 SELECT ?k ?v WHERE {
                     VALUES ?k { %s }
                     ?item %s ?k ;
                           %s ?b .
                        ?b %s ?v .
                 }
-            ''').strip() % (
+            ''') % (
                 ids,
                 key_field,
                 by_field,
                 val_field,
             )
         elif key_field is None:
-            query = dedent('''
+            query = _template('''
                 SELECT ?k ?v WHERE {
                     VALUES ?k { %s }
                     ?k %s ?v.
                 }
-            ''').strip() % (
+            ''') % (
                 ids,
                 val_field,
             )
         else:
-            query = dedent('''
+            query = _template('''
                 SELECT ?k ?v WHERE {
                     VALUES ?k { %s }
                     ?item %s ?k.
                     ?item %s ?v.
                 }
-            ''').strip() % (
+            ''') % (
                 ids,
                 key_field,
                 val_field,
@@ -345,8 +483,8 @@ class WikiApi:
         key_field: str = None,
         val_field: str = None,
         by_field: str = None,
-        re_k: Optional[re.Pattern] = None,
-        re_v: Optional[re.Pattern] = None
+        re_k: Optional[Validator] = None,
+        re_v: Optional[Validator] = None
     ):
         query = self.__mk_query(
             *args,
@@ -363,8 +501,8 @@ class WikiApi:
         key_field: str = None,
         val_field: str = None,
         by_field: str = None,
-        re_k: Optional[re.Pattern] = None,
-        re_v: Optional[re.Pattern] = None
+        re_k: Optional[Validator] = None,
+        re_v: Optional[Validator] = None
     ):
         query = self.__mk_query(
             *args,
@@ -396,89 +534,90 @@ class WikiApi:
             done.update(_get_dict(val_field, *undone))
         return done
 
-    @cache
     def get_countries(self, *args: str):
-        def _get_dict(val_field: str, by_field: str = None):
-            return self.get_dict_uniq_tuple(*args, key_field="wdt:P345", val_field=val_field, by_field=by_field)
-
-        data: dict[str, dict[str, tuple[str, ...]]] = dict(
-            main=_get_dict(val_field="wdt:P495"),
-            prod=_get_dict(val_field="wdt:P17", by_field="wdt:P272"),
-            dire=_get_dict(val_field="wdt:P27", by_field="wdt:P57"),
-            writ=_get_dict(val_field="wdt:P27", by_field="wdt:P58"),
-            acto=_get_dict(val_field="wdt:P27", by_field="wdt:P161"),
-            country_lang=self.__get_countries_from_lang(*args)
-        )
+        return self.__get_countries(*sorted(set(a for a in args if a)))
+
+    @cache
+    def __get_countries(self, *args: str):
+        data: dict[str, dict[str, tuple[str, ...]]] = {t: {} for t in COUNTRY_PATHS}
+        for imdb, kinds in self.__get_countries_by_kind(*args).items():
+            for t, vls in kinds.items():
+                data[t][imdb] = tuple(vls)
+        data['country_lang'] = self.__get_countries_from_lang(*args)
         q_vals: set[str] = set()
         for dct in data.values():
             for vls in dct.values():
                 q_vals.update(vls)
         alpha = self.get_alpha3(*q_vals)
+        to_alpha = {q: alpha.get(q) for q in q_vals}.__getitem__
         for k, dct in list(data.items()):
             data[k] = {
-                kk: tuple(x for x in map(alpha.get, vv) if x is not None)
+                kk: tuple(filter(None, map(to_alpha, vv)))
                 for kk, vv in dct.items()
             }
         r: dict[str, WikiImdbCountry] = {}
         for imdb in args:
-            director = data['dire'].get(imdb, tuple())
-            producer = data['prod'].get(imdb, tuple())
-            writer = data['writ'].get(imdb, tuple())
-            casting = data['acto'].get(imdb, tuple())
             r[imdb] = WikiImdbCountry(
                 imdb=imdb,
                 main=data['main'].get(imdb, tuple()),
-                producer={p: producer.count(p) for p in producer},
-                director={d: director.count(d) for d in director},
-                writer={w: writer.count(w) for w in writer},
-                casting={c: casting.count(c) for c in casting},
+                producer=dict(Counter(data['prod'].get(imdb, tuple()))),
+                director=dict(Counter(data['dire'].get(imdb, tuple()))),
+                writer=dict(Counter(data['writ'].get(imdb, tuple()))),
+                casting=dict(Counter(data['acto'].get(imdb, tuple()))),
                 country_lang=data['country_lang'].get(imdb, tuple())
             )
         return r
 
-    def __get_countries_from_lang(self, *imdb: str) -> dict[str, tuple[str, ...]]:
-        imdb = tuple(sorted(set(imdb)))
-        if len(imdb) == 0:
-            return {}
-        imdb_lang = self.get_dict_uniq_tuple(*imdb, key_field="wdt:P345", val_field="wdt:P364")
-        q_lang: set[str] = set()
-        for lg in imdb_lang.values():
-            q_lang.update(lg)
-        q_lang_countries = self.__get_countries_from_q_lang(*q_lang)
-        obj: dict[str, set[str]] = defaultdict(set)
-        for i in imdb:
-            for countries in map(q_lang_countries.get, imdb_lang.get(i, tuple())):
-                if countries:
-                    obj[i].update(countries)
-        r = {k: tuple(sorted(v)) for k, v in obj.items()}
-        return r
+    @retry_fetch(chunk_size=300)
+    def __get_countries_by_kind(self, *args: str) -> dict[str, dict[str, tuple[str, ...]]]:
+        ids = " ".join(f'"{x}"' for x in args)
+        union = "\n    UNION\n    ".join(
+            f'{{ ?item {path} ?v . BIND("{t}" AS ?t) }}' for t, path in COUNTRY_PATHS.items()
+        )
+        query = _template("""
+            SELECT ?k ?t ?v WHERE {
+                VALUES ?k { %s }
+                ?item wdt:P345 ?k .
+                %s
+            }
+        """) % (ids, union)
+        r: dict[str, dict[str, dict[str, None]]] = defaultdict(lambda: defaultdict(dict))
+        for b in self.query(query):
+            k, t, v = (_parse_wiki_val((b.get(x) or {}).get('value')) for x in ('k', 't', 'v'))
+            if None in (k, t, v) or t not in COUNTRY_PATHS:
+                continue
+            if not re_imdb.match(k):
+                continue
+            r[k][t][v] = None
+        return {k: {t: tuple(v) for t, v in kinds.items()} for k, kinds in r.items()}
 
     @retry_fetch(chunk_size=300)
-    def __get_countries_from_q_lang(self, *q_lang: str):
-        query = '''
+    def __get_countries_from_lang(self, *imdb: str) -> dict[str, tuple[str, ...]]:
+        query = _template('''
         SELECT ?k ?v WHERE {
             VALUES ?k { %s }
+            ?item wdt:P345 ?k ;
+                  wdt:P364 ?lang .
             # O bien idioma oficial (P37)
-            { ?v wdt:P37 ?k . }
+            { ?v wdt:P37 ?lang . }
             UNION
             # O bien lengua hablada aquí (P2936)
-            { ?v wdt:P2936 ?k . }
+            { ?v wdt:P2936 ?lang . }
             ?v wdt:P31/wdt:P279* wd:Q3624078 .
         }
-        ''' % " ".join(q_lang)
-        return self.__get_dict_uniq_tuple(query)
+        ''') % " ".join(f'"{x}"' for x in imdb)
+        obj = self.__get_dict_uniq_tuple(query)
+        return {k: tuple(sorted(v)) for k, v in obj.items()}
 
     @retry_fetch(chunk_size=1000)
     def get_wiki_url(self, *args):
         ids = " ".join(map(lambda x: f'"{x}"', args))
-        order = []
-        for i, lang in enumerate(LANGS, start=1):
-            order.append(f'IF(CONTAINS(STR(?site), "://{lang}.wikipedia.org"), {i},')
-        len_order = len(order)
-        order.append(f"{len_order}" + (')' * len_order))
-        order_str = " ".join(order)
-
-        query = dedent("""
+        site_values = " ".join(
+            f'(<https://{lang}.wikipedia.org/> {i})' for i, lang in enumerate(LANGS, start=1)
+        )
+        site_default = len(LANGS)
+
+        query = _template("""
             SELECT ?k ?v WHERE {
             VALUES ?k { %s }
 
@@ -488,10 +627,8 @@ class WikiApi:
 
             FILTER(CONTAINS(STR(?site), "wikipedia.org"))
 
-            BIND(
-                %s
-                AS ?priority
-            )
+            OPTIONAL { VALUES (?site ?sitePri) { %s } }
+            BIND(COALESCE(?sitePri, %s) AS ?priority)
             {
                 SELECT ?k (MIN(?priority) AS ?minPriority) WHERE {
                 VALUES ?k { %s }
@@ -499,10 +636,8 @@ class WikiApi:
                 ?v schema:about ?item ;
                         schema:isPartOf ?site .
                 FILTER(CONTAINS(STR(?site), "wikipedia.org"))
-                BIND(
-                    %s
-                    AS ?priority
-                )
+                OPTIONAL { VALUES (?site ?sitePri) { %s } }
+                BIND(COALESCE(?sitePri, %s) AS ?priority)
                 }
                 GROUP BY ?k
             }
@@ -510,8 +645,7 @@ class WikiApi:
             FILTER(?priority = ?minPriority)
             }
             ORDER BY ?k
-        """ % (ids, order_str, ids, order_str)
-        ).strip()
+        """) % (ids, site_values, site_default, ids, site_values, site_default)
         return self.__get_dict_1_to_1(
             query,
             re_k=re_imdb,
@@ -519,7 +653,7 @@ class WikiApi:
         )
 
     def get_imdb_filmaffinity(self):
-        query = dedent("""
+        query = _template("""
         SELECT ?k ?v WHERE {
             ?item wdt:P345 ?k .
             ?item wdt:P480 ?v .
@@ -538,7 +672,7 @@ class WikiApi:
         return MappingProxyType({k: int(v) for k, v in obj.items()})
 
     def get_imdb_wiki_es(self):
-        query = dedent("""
+        query = _template("""
             SELECT ?k ?v WHERE {
                 ?item wdt:P345 ?k .
                 ?v schema:about ?item ;
@@ -548,21 +682,24 @@ class WikiApi:
             GROUP BY ?item ?k ?v
             HAVING (COUNT(?v) = 1)
             ORDER BY ?item
-        """).strip()
-        return self.__get_dict_1_to_1(
+        """)
+        obj = self.__get_dict_1_to_1(
             query,
             re_k=re_imdb,
             re_v=re.compile(r"^https://es\.wikipedia\.org/wiki/\S+$"),
             page_size=100
         )
+        return MappingProxyType(obj)
 
     def __iter_k_v(
         self,
         query: str,
-        re_k: Optional[re.Pattern] = None,
-        re_v: Optional[re.Pattern] = None,
+        re_k: Optional[Validator] = None,
+        re_v: Optional[Validator] = None,
         page_size: int = None
     ):
+        match_k = _matcher(re_k)
+        match_v = _matcher(re_v)
         for b in self.query(query, page_size=page_size):
             vk = b['k']
             vv = b['v']
@@ -580,54 +717,39 @@ class WikiApi:
                 raise ValueError(f"Invalid key: {k}")
             if not isinstance(v, str):
                 raise ValueError(f"Invalid value: {v}")
-            k = k.strip()
-            v = v.strip()
-            if 0 in map(len, (k, v)):
+            if match_k and not match_k(k):
                 continue
-            if re_k and not re_k.match(k):
-                continue
-            if re_v and not re_v.match(v):
+            if match_v and not match_v(v):
                 continue
             yield k, v
 
     def __get_dict_uniq_tuple(
         self,
         query: str,
-        re_k: Optional[re.Pattern] = None,
-        re_v: Optional[re.Pattern] = None,
+        re_k: Optional[Validator] = None,
+        re_v: Optional[Validator] = None,
         page_size: int = None
     ):
-        r: dict[str, list[str]] = defaultdict(list)
+        r: dict[str, dict[str, None]] = defaultdict(dict)
         for k, v in self.__iter_k_v(query, re_k=re_k, re_v=re_v, page_size=page_size):
-            if v not in r[k]:
-                r[k].append(v)
-        obj = {k: tuple(v) for k, v in r.items()}
-        return MappingProxyType(obj)
+            r[k][v] = None
+        return {k: tuple(v) for k, v in r.items()}
 
     def __get_dict_1_to_1(
         self,
         query: str,
-        re_k: Optional[re.Pattern] = None,
-        re_v: Optional[re.Pattern] = None,
+        re_k: Optional[Validator] = None,
+        re_v: Optional[Validator] = None,
         page_size: int = None
     ):
         obj = self.__get_dict_uniq_tuple(query, re_k=re_k, re_v=re_v, page_size=page_size)
-        rev: dict[Any, set[str]] = defaultdict(set)
-        for k, v in obj.items():
-            for x in v:
-                rev[x].add(k)
-        r: dict[str, str] = dict()
-        for k, v in obj.items():
-            if len(v) != 1:
-                continue
-            val = v[0]
-            if len(rev[val]) != 1:
-                continue
-            r[k] = val
-        return MappingProxyType(r)
+        # los valores de cada clave ya son únicos, así que contar
+        # apariciones es contar claves distintas por valor
+        count = Counter(chain.from_iterable(obj.values()))
+        return {k: v[0] for k, v in obj.items() if len(v) == 1 and count[v[0]] == 1}
 
 
-WIKI = WikiApi()
+WIKI = WikiApi(max_workers=int(get_env('WIKI_WORKERS', default='4')))
 
 if __name__ == "__main__":
     from core.config_log import config_log
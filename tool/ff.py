@@ -1,40 +1,55 @@
 from core.filmaffinity import FilmAffinityApi
 from core.dblite import DBlite, gW
 from core.wiki import WIKI
+from collections import defaultdict
 import sys
 from time import sleep
 
+MOVIE_WHERE = '''
+    year is not null and
+    duration > 60 and
+    votes > 10000
+'''
 
 DB = DBlite("imdb.sqlite", quick_release=True)
 i_f = WIKI.get_imdb_filmaffinity()
 done: set[str] = set(i_f.keys()).union(
     DB.to_tuple('select movie from extra where filmaffinity is not null')
 )
-for x, (i, year) in enumerate(DB.select('''
+titles: dict[str, list[str]] = defaultdict(list)
+for i, t in DB.select(f'''
+    select
+        t.movie,
+        t.title
+    from
+        title t join movie m on m.id = t.movie
+    where
+        {MOVIE_WHERE}
+'''):
+    titles[i].append(t)
+
+for i, year in DB.select(f'''
     select
         id,
         year
     from
         movie
     where
-        year is not null and
-        duration > 60 and
-        votes > 10000
+        {MOVIE_WHERE}
     order by
         votes desc,
         rating desc,
         duration desc,
         year desc
+    limit -1 offset 10800
     '''
-)):
-    if x < 10800:
-        continue
+):
     if i in done:
         continue
     if not FilmAffinityApi.ACTIVE:
         sys.exit()
-    tt = DB.to_tuple("select title from title where movie = ?", i)
-    if len(tt) == 0:
+    tt = titles.get(i)
+    if not tt:
         continue
     sleep(2)
     ff = FilmAffinityApi.search(year, *tt)